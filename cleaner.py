@@ -1,89 +1,384 @@
 import sys
 import os
+import errno
+import functools
+import json
+import re
 import shutil
-import xlrd
-import pandas as pd
+import queue
+import threading
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout,
-                             QWidget, QLineEdit, QProgressBar, QMessageBox,
+                             QWidget, QLineEdit, QLabel, QProgressBar, QMessageBox,
                              QFileDialog, QMenuBar, QAction)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtCore import QThread, QThreadPool, QRunnable, QObject, pyqtSignal, Qt
 from PyQt5.QtGui import QIcon
 
+# folder names are indexed by their alphanumeric tokens, e.g. "12345 Client-Name" -> 12345, Client, Name
+TOKEN_SPLIT = re.compile(r'[^0-9A-Za-z]+')
+
+# folder names left in the parent directory after the last run, reused while the parent's mtime is unchanged
+INDEX_PATH = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'FolderSweeper', 'index.json')
+
+class IndexedFolder:
+    # stands in for os.DirEntry when the folder map comes from the saved index
+    __slots__ = ('name', 'path', '_stat')
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self._stat = None
+
+    def stat(self):
+        # the folder's own mtime isn't covered by the parent's, so it is read fresh (once) when it matches
+        if self._stat is None:
+            self._stat = os.stat(self.path)
+        return self._stat
+
+@functools.lru_cache(maxsize=None)
+def month_folder_name(year, month):
+    # "%m %B %Y" goes through the C runtime's locale code, so it is formatted once per month seen
+    return datetime(year, month, 1).strftime("%m %B %Y")
+
+def read_first_column(file_path):
+    # reads the first sheet's first column directly, skipping the header row like pd.read_excel did
+    # imported on first use so the window opens without loading the Excel readers
+    if file_path.lower().endswith('.xlsx'):
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = workbook.worksheets[0].iter_rows(min_row=2, max_col=1, values_only=True)
+            cells = [row[0] if row else None for row in rows]
+        finally:
+            workbook.close()
+    else:
+        import xlrd
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        try:
+            sheet = book.sheet_by_index(0)
+            cells = sheet.col_values(0, start_rowx=1) if sheet.ncols else []
+        finally:
+            book.release_resources()
+
+    # dict keeps the sheet order while dropping repeated order numbers (one per line item)
+    values = {}
+    for cell in cells:
+        if cell is None:
+            continue
+        # xlrd gives every number as a float, order numbers should read "12345" not "12345.0"
+        if isinstance(cell, float) and cell.is_integer():
+            cell = int(cell)
+        value = str(cell).strip()
+        if value:
+            values[value] = None
+    return list(values)
+
+class WorkerSignals(QObject):
+    result = pyqtSignal(str, list)
+    error = pyqtSignal(str, str)
+
+class ParseJob(QRunnable):
+    # reads one workbook on the processor's thread pool, results go back through signals
+    def __init__(self, file_path, file_name, cancelled):
+        super().__init__()
+        self.file_path = file_path
+        self.file_name = file_name
+        self.cancelled = cancelled
+        self.signals = WorkerSignals()
+
+    def run(self):
+        # still reports back when cancelled, so every queued file yields exactly one result
+        if self.cancelled.is_set():
+            self.signals.error.emit(self.file_name, "cancelled")
+            return
+        try:
+            values = read_first_column(self.file_path)
+        except Exception as e:
+            self.signals.error.emit(self.file_name, str(e))
+        else:
+            self.signals.result.emit(self.file_name, values)
+
 class FolderProcessor(QThread):
     progress = pyqtSignal(int)
-    finished = pyqtSignal()
+    status = pyqtSignal(str)
+    finished = pyqtSignal(bool)  # False when the run was cancelled before all its work was done
 
-    def __init__(self, xls_dir, parent_dir, completed_dir, debug_mode=False):
+    def __init__(self, xls_dir, parent_dir, completed_dir, debug_mode=False, substring_match=False):
         super().__init__()
         self.xls_dir = xls_dir
         self.parent_dir = parent_dir
         self.completed_dir = completed_dir
         self.debug_mode = debug_mode
+        self.substring_match = substring_match  # old O(values * folders) scan, kept for checking the index against
+        self._created_dirs = set()
+        self._taken_names = {}  # destination folder -> normcased names already in it
+        self._last_pct = -1
+        self._failed_moves = []  # folders that are still in the parent after a failed move
+        self._pool = QThreadPool()
+        self._cancelled = threading.Event()
+
+    def requestInterruption(self):
+        # parse jobs that haven't started yet skip their workbook
+        self._cancelled.set()
+        super().requestInterruption()
+
+    def _stop_jobs(self):
+        # no parse job may outlive the run, their signals are torn down with it
+        self._cancelled.set()
+        self._pool.clear()
+        self._pool.waitForDone()
 
     def debug_print(self, message):
         if self.debug_mode:
             print(message)
 
-    def move_folder(self, source_folder, destination_folder):
-        self.debug_print(f"Moving folder from {source_folder} to {destination_folder}")
-        
-        if not os.path.exists(destination_folder):
-            os.makedirs(destination_folder)
-            self.debug_print(f"Created destination folder: {destination_folder}")
-
-        base_name = os.path.basename(source_folder)
-        new_folder_path = os.path.join(destination_folder, base_name)
+    def _claim_name(self, taken, base_name):
+        # "Foo", "Foo (1)", "Foo (2)"... checked against the destination's listing, no filesystem calls
+        new_name = base_name
         counter = 1
-        while os.path.exists(new_folder_path):
-            self.debug_print(f"Folder {new_folder_path} already exists, renaming...")
-            new_folder_path = os.path.join(destination_folder, f"{base_name} ({counter})")
+        while os.path.normcase(new_name) in taken:
+            if self.debug_mode:
+                self.debug_print(f"Folder {new_name} already exists, renaming...")
+            new_name = f"{base_name} ({counter})"
             counter += 1
+        taken.add(os.path.normcase(new_name))
+        return new_name
 
-        shutil.move(source_folder, new_folder_path)
+    def move_folder(self, source_folder, destination_folder):
+        self.debug_print(f"Moving folder from {source_folder} to {destination_folder}")
+        
+        # each destination is created and listed once per run, name collisions are then checked in memory
+        if destination_folder not in self._created_dirs:
+            os.makedirs(destination_folder, exist_ok=True)
+            self._created_dirs.add(destination_folder)
+            self._taken_names[destination_folder] = {os.path.normcase(name) for name in os.listdir(destination_folder)}
+            self.debug_print(f"Prepared destination folder: {destination_folder}")
+        new_name = self._claim_name(self._taken_names[destination_folder], os.path.basename(source_folder))
+        new_folder_path = os.path.join(destination_folder, new_name)
+
+        # same volume is a single rename, shutil.move's copy + delete is only needed across volumes
+        try:
+            os.rename(source_folder, new_folder_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOTSUP):
+                raise
+            self.debug_print(f"Rename not possible ({e.strerror}), copying instead")
+            shutil.move(source_folder, new_folder_path)
         self.debug_print(f"Folder moved successfully to {new_folder_path}")
 
-    def run(self):
-        self.debug_print("Thread started")
-        self.debug_print(f"Started processing Excel files from {self.xls_dir}")
-        
-        folder_map = {folder_name: os.path.join(self.parent_dir, folder_name) 
-                      for folder_name in os.listdir(self.parent_dir) 
-                      if os.path.isdir(os.path.join(self.parent_dir, folder_name))}
+    def _folder_tokens(self, folder_name):
+        # distinct tokens only, "12345 Smith 12345" must be listed once under 12345
+        return [token for token in dict.fromkeys(TOKEN_SPLIT.split(folder_name)) if token]
+
+    def build_token_index(self, folder_map):
+        token_index = {}
+        for folder_name in folder_map:
+            for token in self._folder_tokens(folder_name):
+                token_index.setdefault(token, []).append(folder_name)
+        return token_index
+
+    def evict_folder(self, folder_name, folder_map, token_index):
+        # a folder that has been moved (or failed to move) must not be matched again
+        del folder_map[folder_name]
+        for token in self._folder_tokens(folder_name):
+            names = token_index.get(token)
+            if names and folder_name in names:
+                names.remove(folder_name)
+                if not names:
+                    del token_index[token]
+
+    def find_matches(self, value, folder_map, token_index):
+        if self.substring_match:
+            return [folder_name for folder_name in folder_map if value in folder_name]
+
+        tokens = [token for token in TOKEN_SPLIT.split(value) if token]
+        if not tokens:
+            return []
+        # candidates share the value's first token, the substring check covers multi-token values like "123-45"
+        # each folder appears at most once per token list, so no name is returned twice
+        candidates = token_index.get(tokens[0], ())
+        if len(tokens) == 1 and tokens[0] == value:
+            return list(candidates)
+        return [folder_name for folder_name in candidates if value in folder_name]
+
+    def _index_key(self):
+        return os.path.normcase(os.path.abspath(self.parent_dir))
+
+    def _read_index(self):
+        # anything that isn't the expected {parent: {...}} mapping is treated as no index
+        try:
+            with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            self.debug_print(f"No usable folder index: {str(e)}")
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _load_index(self, parent_mtime):
+        entry = self._read_index().get(self._index_key())
+        if not isinstance(entry, dict) or entry.get('mtime_ns') != parent_mtime:
+            return None
+        folder_names = entry.get('folders')
+        if not isinstance(folder_names, list) or not all(isinstance(name, str) for name in folder_names):
+            return None
+        return folder_names
+
+    def _save_index(self, folder_names):
+        # taken after this run's own moves, so only someone else touching the share invalidates it
+        try:
+            index = self._read_index()
+            index[self._index_key()] = {'mtime_ns': os.stat(self.parent_dir).st_mtime_ns, 'folders': folder_names}
+
+            os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+            tmp_path = INDEX_PATH + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, INDEX_PATH)
+        except OSError as e:
+            self.debug_print(f"Could not save folder index: {str(e)}")
+
+    def _scan_parent(self):
+        folder_names = self._load_index(os.stat(self.parent_dir).st_mtime_ns)
+        if folder_names is not None:
+            folder_map = {name: IndexedFolder(name, os.path.join(self.parent_dir, name)) for name in folder_names}
+            self.debug_print(f"Folder map loaded from index with {len(folder_map)} folders")
+            return folder_map
+
+        # scandir entries carry their own stat info, no extra round trip per folder on the share
+        folder_map = {}
+        with os.scandir(self.parent_dir) as it:
+            for entry in it:
+                # the walk over the share is the slow part, so cancelling is checked per entry
+                if self.isInterruptionRequested():
+                    return None
+                if entry.is_dir(follow_symlinks=False):
+                    folder_map[entry.name] = entry
 
         self.debug_print(f"Folder map created with {len(folder_map)} folders from parent directory")
-
-        total_files = len([f for f in os.listdir(self.xls_dir) if f.endswith(('.xls', '.xlsx'))])
-        self.debug_print(f"Total Excel files to process: {total_files}")
-        progress_step = 100 / total_files if total_files > 0 else 100
-
-        for i, file_name in enumerate(os.listdir(self.xls_dir)):
-            if file_name.endswith(('.xls', '.xlsx')):
-                file_path = os.path.join(self.xls_dir, file_name)
+        return folder_map
+
+    def _emit_progress(self, done, total):
+        # only emit when the percentage actually changes, at most ~100 repaints of the progress bar per phase
+        pct = int(done * 100 / total) if total else 100
+        if pct != self._last_pct:
+            self.progress.emit(pct)
+            self._last_pct = pct
+
+    def _process_files(self, parsed, total_files, folder_map):
+        # matches are only planned here, grouped by destination month folder, and moved afterwards
+        token_index = self.build_token_index(folder_map)
+        plan = {}
+
+        for i in range(total_files):
+            if self.isInterruptionRequested():
+                return None
+            file_name, first_column_values, error = parsed.get()
+            # the hot-loop messages are guarded so their f-strings aren't built when debug mode is off
+            if self.debug_mode:
                 self.debug_print(f"Processing file: {file_name}")
-                
-                try:
-                    df = pd.read_excel(file_path, usecols=[0])
-                    first_column_values = df.iloc[:, 0].dropna().astype(str).tolist()
-                    self.debug_print(f"Extracted values from first column: {first_column_values}")
+            if error is not None:
+                self.debug_print(f"Error processing {file_name}: {error}")
 
-                    for value in first_column_values:
-                        for folder_name, folder_path in folder_map.items():
-                            if value in folder_name:
-                                self.debug_print(f"Match found: {value} in folder {folder_name}")
-                                modified_date = datetime.fromtimestamp(os.path.getmtime(folder_path))
-                                month_folder = modified_date.strftime("%m %B %Y")
-                                completed_subfolder = os.path.join(self.completed_dir, month_folder)
-                                self.debug_print(f"Moving folder {folder_name} to completed subfolder {completed_subfolder}")
-                                self.move_folder(folder_path, completed_subfolder)
+            try:
+                if self.debug_mode:
+                    self.debug_print(f"Extracted values from first column: {first_column_values}")
 
+                for value in first_column_values:
+                    if self.isInterruptionRequested():
+                        return None
+                    for folder_name in self.find_matches(value, folder_map, token_index):
+                        # backstop, a stale index entry must not abort the rest of the workbook
+                        folder_entry = folder_map.get(folder_name)
+                        if folder_entry is None:
+                            continue
+                        if self.debug_mode:
+                            self.debug_print(f"Match found: {value} in folder {folder_name}")
+                        # stat() is cached on the entry (DirEntry from the scan, IndexedFolder from the saved index)
+                        try:
+                            modified_date = datetime.fromtimestamp(folder_entry.stat().st_mtime)
+                        except OSError as e:
+                            # an indexed folder someone else removed or renamed since the last run
+                            self.debug_print(f"Skipping {folder_name}: {str(e)}")
+                            self.evict_folder(folder_name, folder_map, token_index)
+                            continue
+                        month_folder = month_folder_name(modified_date.year, modified_date.month)
+                        completed_subfolder = os.path.join(self.completed_dir, month_folder)
+                        plan.setdefault(completed_subfolder, []).append((folder_name, folder_entry.path))
+                        # every matching folder moves: one with the order number as a whole token of its name
+                        # (or anywhere in it with substring_match). eviction keeps later files from planning it twice
+                        self.evict_folder(folder_name, folder_map, token_index)
+
+            except Exception as e:
+                self.debug_print(f"Error processing {file_name}: {str(e)}")
+
+            self._emit_progress(i + 1, total_files)
+
+        return plan
+
+    def _move_planned(self, plan):
+        # one bucket at a time, so each month folder is created and listed once (see move_folder)
+        total_moves = sum(len(folders) for folders in plan.values())
+        self.debug_print(f"Moving {total_moves} folders into {len(plan)} completed subfolders")
+        self._last_pct = -1
+        self._emit_progress(0, total_moves)
+
+        done = 0
+        for completed_subfolder, folders in plan.items():
+            for folder_name, folder_path in folders:
+                if self.isInterruptionRequested():
+                    return False
+                if self.debug_mode:
+                    self.debug_print(f"Moving folder {folder_name} to completed subfolder {completed_subfolder}")
+                try:
+                    self.move_folder(folder_path, completed_subfolder)
                 except Exception as e:
-                    self.debug_print(f"Error processing {file_name}: {str(e)}")
-
-            self.progress.emit(int((i + 1) * progress_step))
+                    self.debug_print(f"Error moving {folder_name}: {str(e)}")
+                    self._failed_moves.append(folder_name)
+                done += 1
+                self._emit_progress(done, total_moves)
+        return True
 
-        self.debug_print("Processing finished")
-        self.finished.emit()
+    def run(self):
+        self.debug_print("Thread started")
+        self.debug_print(f"Started processing Excel files from {self.xls_dir}")
+        self._emit_progress(0, 1)
+
+        with os.scandir(self.xls_dir) as it:
+            xls_files = [entry for entry in it
+                         if entry.name.lower().endswith(('.xls', '.xlsx')) and entry.is_file()]
+        self.debug_print(f"Total Excel files to process: {len(xls_files)}")
+
+        # workbooks start parsing right away on the pool, so the reads overlap the (slow) parent folder scan.
+        # direct connections hand results to this thread through the queue, this thread has no event loop
+        parsed = queue.Queue()
+        for entry in xls_files:
+            job = ParseJob(entry.path, entry.name, self._cancelled)
+            job.signals.result.connect(lambda name, values: parsed.put((name, values, None)), Qt.DirectConnection)
+            job.signals.error.connect(lambda name, message: parsed.put((name, [], message)), Qt.DirectConnection)
+            self._pool.start(job)
+
+        # the scan and the matching return None when cancelled, nothing has been moved at that point
+        completed = False
+        try:
+            self.status.emit("Indexing parent folder...")
+            folder_map = self._scan_parent()
+
+            if folder_map is not None:
+                self.status.emit("Matching invoiced orders...")
+                plan = self._process_files(parsed, len(xls_files), folder_map)
+
+                if plan is not None:
+                    self.status.emit("Moving folders...")
+                    completed = self._move_planned(plan)
+
+                # moved folders are evicted already, a cancelled run may have evicted folders it never moved
+                if completed:
+                    self._save_index(list(folder_map) + self._failed_moves)
+        finally:
+            self._stop_jobs()
+
+        self.debug_print("Processing finished" if completed else "Processing cancelled")
+        self.finished.emit(completed)
 
 
 class MainWindow(QMainWindow):
@@ -95,7 +390,7 @@ class MainWindow(QMainWindow):
 
     def initUI(self):
         self.setWindowTitle("Cleaner")
-        self.setFixedSize(400, 300)
+        self.setFixedSize(400, 350)
         self.setWindowIcon(QIcon('cleaner.ico'))
 
         layout = QVBoxLayout()
@@ -132,6 +427,14 @@ class MainWindow(QMainWindow):
         self.start_button.clicked.connect(self.start_processing)
         layout.addWidget(self.start_button)
 
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_processing)
+        layout.addWidget(self.cancel_button)
+
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
         self.progress_bar = QProgressBar(self)
         self.progress_bar.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.progress_bar)
@@ -248,14 +551,32 @@ class MainWindow(QMainWindow):
 
         self.debug_print("Starting processing thread")
         self.progress_bar.setValue(0)
+        self.status_label.setText("Starting...")
         self.processor = FolderProcessor(xls_dir, parent_dir, completed_dir, self.debug_mode)
         self.processor.progress.connect(self.progress_bar.setValue)
+        self.processor.status.connect(self.status_label.setText)
         self.processor.finished.connect(self.processing_finished)
+        self.start_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
         self.processor.start()
 
-    def processing_finished(self):
+    def cancel_processing(self):
+        # checked during the parent scan, between files and between moves, pending workbooks are skipped.
+        # folders already moved stay moved
+        self.debug_print("Cancel requested")
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling...")
+        self.processor.requestInterruption()
+
+    def processing_finished(self, completed):
         self.debug_print("Processing finished")
-        QMessageBox.information(self, "Finished", "The folder is squeaky clean.", QMessageBox.Ok)
+        self.status_label.setText("")
+        self.start_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        if completed:
+            QMessageBox.information(self, "Finished", "The folder is squeaky clean.", QMessageBox.Ok)
+        else:
+            QMessageBox.information(self, "Cancelled", "Cleaning was cancelled.", QMessageBox.Ok)
 
     def toggle_debug_mode(self):
         self.debug_mode = not self.debug_mode